@@ -1,14 +1,61 @@
 import asyncio
-import json
+import os
+import re
+import sys
 import uuid
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass
 from pathlib import Path
 
 import click
 import httpx
+import orjson
 from prompt_toolkit import PromptSession
-from prompt_toolkit.history import FileHistory
+from prompt_toolkit.history import FileHistory, ThreadedHistory
 from prompt_toolkit.patch_stdout import patch_stdout
 
+HISTORY_PATH = Path.home() / ".akson_chat_history.txt"
+
+LINE_END = re.compile(rb"\r\n|\r|\n")
+
+
+class MessageIdPool:
+    """Hands out UUID4 message IDs generated in batches on a worker thread."""
+
+    def __init__(self, batch_size: int = 64, low_water: int = 16):
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self._ids: deque[str] = deque()
+        self._refill: asyncio.Task | None = None
+
+    def next(self) -> str:
+        message_id = self._ids.popleft() if self._ids else str(uuid.uuid4())
+        if len(self._ids) < self.low_water:
+            self.refill()
+        return message_id
+
+    def refill(self) -> asyncio.Task:
+        """Start topping up the pool, unless a refill is already running."""
+        if self._refill is None:
+            self._refill = asyncio.create_task(self._fill())
+        return self._refill
+
+    async def _fill(self) -> None:
+        try:
+            self._ids.extend(await asyncio.to_thread(self._generate, self.batch_size))
+        finally:
+            self._refill = None
+
+    @staticmethod
+    def _generate(count: int) -> list[str]:
+        # One urandom read for the whole batch; UUID() sets the version and variant bits.
+        random = os.urandom(16 * count)
+        return [str(uuid.UUID(bytes=random[i : i + 16], version=4)) for i in range(0, len(random), 16)]
+
+
+message_ids = MessageIdPool()
+
 
 async def get_assistants(client: httpx.AsyncClient) -> list[str]:
     response = await client.get(f"/assistants")
@@ -31,93 +78,248 @@ async def get_chat_state(client: httpx.AsyncClient, chat_id: str) -> dict:
     return response.json()
 
 
+async def warm_up_connection(client: httpx.AsyncClient) -> None:
+    # Only the connection is wanted; the response status is irrelevant
+    try:
+        await client.head("/")
+    except httpx.HTTPError:
+        pass
+
+
 async def send_message(client: httpx.AsyncClient, chat_id: str, content: str, assistant: str) -> None:
     response = await client.post(
         f"/{chat_id}/message",
-        json={"content": content, "assistant": assistant, "id": str(uuid.uuid4())},
+        headers={"Content-Type": "application/json"},
+        content=orjson.dumps({"content": content, "assistant": assistant, "id": message_ids.next()}),
     )
     response.raise_for_status()
 
 
+class MessageSender:
+    """Posts messages in the background, in submission order, and prints any failure."""
+
+    def __init__(self, client: httpx.AsyncClient, chat_id: str):
+        self.client = client
+        self.chat_id = chat_id
+        self._lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+
+    def send(self, content: str, assistant: str) -> None:
+        task = asyncio.create_task(self._send(content, assistant))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def wait(self) -> None:
+        await asyncio.gather(*self._tasks)
+
+    async def cancel(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _send(self, content: str, assistant: str) -> None:
+        # The lock wakes waiters in FIFO order, so messages reach the server in the order they were typed
+        async with self._lock:
+            try:
+                await send_message(self.client, self.chat_id, content, assistant)
+            except Exception as e:
+                print(f"Error: {type(e).__name__}: {e}")
+
+
+async def iter_sse_data(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Yield the data field of each server-sent event without decoding the stream to str.
+
+    Lines may end in CRLF, LF or a lone CR, as allowed by the SSE format.
+    """
+    buffer = bytearray()
+    data: list[bytes] = []
+    # Set when the previous chunk ended in \r, whose \n may arrive with the next chunk
+    skip_lf = False
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        buffer.extend(chunk)
+        start = 1 if skip_lf and buffer.startswith(b"\n") else 0
+        skip_lf = False
+        while match := LINE_END.search(buffer, start):
+            line = buffer[start : match.start()]
+            start = match.end()
+            if match.group() == b"\r" and start == len(buffer):
+                skip_lf = True
+            if not line:
+                # A blank line terminates the event; one whose data is empty is not dispatched
+                if data:
+                    payload = b"\n".join(data)
+                    data.clear()
+                    if payload:
+                        yield payload
+            elif line.startswith(b"data:"):
+                data.append(bytes(line[6:] if line.startswith(b"data: ") else line[5:]))
+        del buffer[:start]
+
+
+# Serialisations of an add_chunk event whose only other key is the chunk (compact, and Python json.dumps defaults)
+ADD_CHUNK_PREFIXES = (b'{"type":"add_chunk","chunk":"', b'{"type": "add_chunk", "chunk": "')
+
+
+def parse_add_chunk(payload: bytes) -> str | None:
+    """Return the text of an add_chunk event without decoding it into a dict.
+
+    Returns None when the payload is not in one of the expected shapes, so the caller falls back to a full parse.
+    """
+    for prefix in ADD_CHUNK_PREFIXES:
+        if payload.startswith(prefix) and payload.endswith(b'"}') and len(payload) >= len(prefix) + 2:
+            raw = payload[len(prefix) : -2]
+            if b"\\" not in raw:
+                # An unescaped quote means more keys follow the chunk
+                return None if b'"' in raw else raw.decode()
+            try:
+                return orjson.loads(b'"' + raw + b'"')
+            except orjson.JSONDecodeError:
+                return None
+    return None
+
+
+def on_begin_message(data: dict) -> None:
+    print("\nAssistant: ", end="", flush=True)
+
+
+def on_add_chunk(data: dict) -> None:
+    print(data["chunk"], end="", flush=True)
+
+
+def on_end_message(data: dict) -> None:
+    print("\n")
+
+
+EVENT_HANDLERS = {
+    "begin_message": on_begin_message,
+    "add_chunk": on_add_chunk,
+    "end_message": on_end_message,
+}
+
+
 async def stream_events(client: httpx.AsyncClient, chat_id: str):
     async with client.stream("GET", f"/{chat_id}/events", timeout=None) as response:
-        async for line in response.aiter_lines():
-            if line.startswith("data: "):
-                data = json.loads(line[6:])
-                match data:
-                    case {"type": "begin_message"}:
-                        print("\nAssistant: ", end="", flush=True)
-                    case {"type": "add_chunk"}:
-                        print(data["chunk"], end="", flush=True)
-                    case {"type": "end_message"}:
-                        print("\n")
+        async for payload in iter_sse_data(response.aiter_bytes()):
+            chunk = parse_add_chunk(payload)
+            if chunk is not None:
+                print(chunk, end="", flush=True)
+                continue
+
+            # Events that are not JSON objects (e.g. keep-alive pings) are ignored
+            try:
+                data = orjson.loads(payload)
+            except orjson.JSONDecodeError:
+                continue
+            if not isinstance(data, dict):
+                continue
+            handler = EVENT_HANDLERS.get(data.get("type"))
+            if handler:
+                handler(data)
+
+
+@dataclass
+class CommandContext:
+    client: httpx.AsyncClient
+    chat_id: str
+    assistant: str
+
+
+async def cmd_assistants(context: CommandContext, arg: str) -> None:
+    assistants = await get_assistants(context.client)
+    print(f"Available assistants: {', '.join(assistants)}\n")
+
+
+async def cmd_assistant(context: CommandContext, arg: str) -> None:
+    name = arg.partition(" ")[0]
+    if name:
+        await set_assistant(context.client, context.chat_id, name)
+        context.assistant = name
+    print(f"Selected assistant: {context.assistant}\n")
+
+
+COMMANDS: dict[str, Callable[[CommandContext, str], Awaitable[None]]] = {
+    "/assistants": cmd_assistants,
+    "/assistant": cmd_assistant,
+}
 
 
 async def chat_loop(client: httpx.AsyncClient, chat_id: str, assistant: str):
-    session = PromptSession(history=FileHistory(Path.home() / ".akson_chat_history.txt"))
-    while True:
-        try:
-            user_input = await session.prompt_async("You: ")
+    session = PromptSession(history=ThreadedHistory(FileHistory(HISTORY_PATH)))
+    context = CommandContext(client, chat_id, assistant)
+    sender = MessageSender(client, chat_id)
+    try:
+        while True:
+            try:
+                user_input = await session.prompt_async("You: ")
 
-            user_input = user_input.strip()
-            if not user_input:
-                continue
+                user_input = user_input.strip()
+                if not user_input:
+                    continue
 
-            # Handle slash commands
-            if user_input.startswith("/"):
-                command, *args = user_input.split(" ")
-                if command == "/assistants":
-                    assistants = await get_assistants(client)
-                    print(f"Available assistants: {', '.join(assistants)}\n")
-                elif command == "/assistant":
-                    if args:
-                        await set_assistant(client, chat_id, args[0])
-                        assistant = args[0]
-                    print(f"Selected assistant: {assistant}\n")
-                else:
-                    print("Unknown command\n")
+                # Handle slash commands
+                if user_input.startswith("/"):
+                    command, _, arg = user_input.partition(" ")
+                    handler = COMMANDS.get(command)
+                    if handler:
+                        await handler(context, arg)
+                    else:
+                        print("Unknown command\n")
 
-                continue
+                    continue
 
-            await send_message(client, chat_id, user_input, assistant)
+                sender.send(user_input, context.assistant)
 
-        except KeyboardInterrupt:
-            continue
-        except EOFError:
-            break
-        except Exception as e:
-            print(f"Error: {type(e).__name__}: {e}")
-            continue
+            except KeyboardInterrupt:
+                continue
+            except EOFError:
+                break
+            except Exception as e:
+                print(f"Error: {type(e).__name__}: {e}")
+                continue
+
+        # Let messages that are still in flight reach the server before the client is closed
+        await sender.wait()
+    finally:
+        # If the loop is cancelled (e.g. the event stream failed), drop pending sends before the client closes
+        await sender.cancel()
 
 
 async def chat(chat_id: str, client: httpx.AsyncClient):
-    # Get chat state
-    chat_state = await get_chat_state(client, chat_id)
+    # Get chat state. The concurrent HEAD leaves a spare pooled connection, so the first message or command
+    # doesn't need a new one while the event stream holds the other. The message ID pool is filled meanwhile,
+    # so the first message already gets a pooled ID.
+    chat_state, _, _ = await asyncio.gather(
+        get_chat_state(client, chat_id), warm_up_connection(client), message_ids.refill()
+    )
     assistant = chat_state["assistant"]
 
     # Print previous messages if they exist
     if "messages" in chat_state:
+        lines = []
         for message in chat_state["messages"]:
             role = "Assistant" if message["role"] == "assistant" else "You"
-            print(f"{role}: {message['content']}\n")
+            lines.append(f"{role}: {message['content']}\n\n")
+        # Write the whole history at once instead of one write per message
+        sys.stdout.write("".join(lines))
+        sys.stdout.flush()
 
     # Patching stdout to make sure that the text appears above the prompt,
     # and that it doesn't destroy the output from the renderer.
     with patch_stdout():
-        # Create tasks for both coroutines
-        chat_task = asyncio.create_task(chat_loop(client, chat_id, assistant))
-        stream_task = asyncio.create_task(stream_events(client, chat_id))
-
-        # Wait for chat loop to complete
+        # Run both coroutines in a task group, so a failing stream also stops the chat loop
         try:
-            await chat_task
-        finally:
-            # Cancel the stream task when chat loop ends
-            stream_task.cancel()
-            try:
-                await stream_task
-            except asyncio.CancelledError:
-                pass
+            async with asyncio.TaskGroup() as tg:
+                stream_task = tg.create_task(stream_events(client, chat_id))
+                chat_task = tg.create_task(chat_loop(client, chat_id, assistant))
+
+                # Cancel the stream task when chat loop ends
+                await chat_task
+                stream_task.cancel()
+        except* Exception as eg:
+            for e in eg.exceptions:
+                print(f"Error: {type(e).__name__}: {e}")
 
 
 async def main_async(chat_id: str | None, base_url: str):
@@ -125,7 +327,13 @@ async def main_async(chat_id: str | None, base_url: str):
         chat_id = str(uuid.uuid4())
         print(f"Using new chat ID: {chat_id}\n")
 
-    client = httpx.AsyncClient(base_url=base_url)
+    # HTTP/2 lets the event stream and the short API calls share one connection (TLS endpoints only;
+    # httpx falls back to HTTP/1.1 for plain http:// URLs).
+    client = httpx.AsyncClient(
+        base_url=base_url,
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=300.0),
+    )
     try:
         await chat(chat_id, client)
     finally:
@@ -140,7 +348,16 @@ def main(chat_id: str | None, base_url: str):
 
     CHAT_ID: Optional chat ID to connect to an existing chat. If not provided, a new UUID will be generated.
     """
-    asyncio.run(main_async(chat_id, base_url))
+    # uvloop is an optional extra; it keeps add_reader() support, which prompt_toolkit needs for stdin
+    loop_factory = None
+    try:
+        import uvloop
+
+        loop_factory = uvloop.new_event_loop
+    except ImportError:
+        pass
+
+    asyncio.run(main_async(chat_id, base_url), loop_factory=loop_factory)
 
 
 if __name__ == "__main__":
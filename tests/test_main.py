@@ -0,0 +1,57 @@
+import asyncio
+import unittest
+from collections.abc import AsyncIterator
+
+from main import iter_sse_data
+
+
+async def _chunks(parts: list[bytes]) -> AsyncIterator[bytes]:
+    for part in parts:
+        yield part
+
+
+def _parse(parts: list[bytes]) -> list[bytes]:
+    async def collect() -> list[bytes]:
+        return [payload async for payload in iter_sse_data(_chunks(parts))]
+
+    return asyncio.run(collect())
+
+
+class IterSseDataTest(unittest.TestCase):
+    def assertParses(self, raw: bytes, expected: list[bytes]) -> None:
+        # The result must not depend on how the stream is split into reads
+        self.assertEqual(_parse([raw]), expected)
+        self.assertEqual(_parse([raw[i : i + 1] for i in range(len(raw))]), expected)
+        for i in range(len(raw) + 1):
+            self.assertEqual(_parse([raw[:i], raw[i:]]), expected, f"split at {i}")
+
+    def test_lf(self):
+        self.assertParses(b'data: {"a":1}\n\ndata: {"b":2}\n\n', [b'{"a":1}', b'{"b":2}'])
+
+    def test_crlf(self):
+        self.assertParses(b"data: a\r\n\r\ndata: b\r\n\r\n", [b"a", b"b"])
+
+    def test_lone_cr(self):
+        self.assertParses(b"data: a\r\rdata: b\r\r", [b"a", b"b"])
+
+    def test_mixed_line_endings(self):
+        self.assertParses(b"data: a\r\n\r\ndata: b\r\rdata: c\n\n", [b"a", b"b", b"c"])
+
+    def test_multiline_data_is_joined(self):
+        self.assertParses(b"data: a\ndata: b\n\n", [b"a\nb"])
+
+    def test_space_after_colon_is_optional(self):
+        self.assertParses(b"data:a\n\n", [b"a"])
+
+    def test_other_fields_and_comments_are_ignored(self):
+        self.assertParses(b": keep-alive\n\nevent: x\nid: 1\ndata: a\n\n", [b"a"])
+
+    def test_empty_data_is_not_dispatched(self):
+        self.assertParses(b"data:\n\ndata: \n\ndata: a\n\n", [b"a"])
+
+    def test_incomplete_event_is_not_dispatched(self):
+        self.assertParses(b"data: a\n\ndata: b\n", [b"a"])
+
+
+if __name__ == "__main__":
+    unittest.main()